@@ -7,10 +7,14 @@ from .sessions import (
     FileSystemSessionInterface,
     MongoDBSessionInterface,
     SqlAlchemySessionInterface,
+    MsgPackSerializer,
+    PickleSerializer,
 )
 
 __version__ = "0.5.9004"
 
+_serializers = {"msgpack": MsgPackSerializer, "pickle": PickleSerializer}
+
 
 class Session(object):
     """This class is used to add Server-side Session to one or more Flask
@@ -60,8 +64,12 @@ class Session(object):
         config.setdefault("SESSION_PERMANENT", True)
         config.setdefault("SESSION_USE_SIGNER", False)
         config.setdefault("SESSION_KEY_PREFIX", "session:")
+        config.setdefault("SESSION_COMPRESS", False)
+        config.setdefault("SESSION_SERIALIZER", "msgpack")
         config.setdefault("SESSION_REDIS", None)
+        config.setdefault("SESSION_REDIS_POOL_SIZE", 64)
         config.setdefault("SESSION_MEMCACHED", None)
+        config.setdefault("SESSION_MEMCACHED_POOL_SIZE", 16)
         config.setdefault(
             "SESSION_FILE_DIR", os.path.join(os.getcwd(), "flask_session")
         )
@@ -73,12 +81,21 @@ class Session(object):
         config.setdefault("SESSION_SQLALCHEMY", None)
         config.setdefault("SESSION_SQLALCHEMY_TABLE", "sessions")
 
+        serializer = config["SESSION_SERIALIZER"]
+        if isinstance(serializer, str):
+            if serializer not in _serializers:
+                raise ValueError(f"Unknown SESSION_SERIALIZER {serializer!r}")
+            serializer = _serializers[serializer]()
+
         if config["SESSION_TYPE"] == "redis":
             session_interface = RedisSessionInterface(
                 config["SESSION_REDIS"],
                 config["SESSION_KEY_PREFIX"],
                 config["SESSION_USE_SIGNER"],
                 config["SESSION_PERMANENT"],
+                config["SESSION_COMPRESS"],
+                config["SESSION_REDIS_POOL_SIZE"],
+                serializer,
             )
         elif config["SESSION_TYPE"] == "memcached":
             session_interface = MemcachedSessionInterface(
@@ -86,6 +103,9 @@ class Session(object):
                 config["SESSION_KEY_PREFIX"],
                 config["SESSION_USE_SIGNER"],
                 config["SESSION_PERMANENT"],
+                config["SESSION_COMPRESS"],
+                config["SESSION_MEMCACHED_POOL_SIZE"],
+                serializer,
             )
         elif config["SESSION_TYPE"] == "filesystem":
             session_interface = FileSystemSessionInterface(
@@ -104,6 +124,8 @@ class Session(object):
                 config["SESSION_KEY_PREFIX"],
                 config["SESSION_USE_SIGNER"],
                 config["SESSION_PERMANENT"],
+                config["SESSION_COMPRESS"],
+                serializer,
             )
         elif config["SESSION_TYPE"] == "sqlalchemy":
             session_interface = SqlAlchemySessionInterface(
@@ -113,8 +135,11 @@ class Session(object):
                 config["SESSION_KEY_PREFIX"],
                 config["SESSION_USE_SIGNER"],
                 config["SESSION_PERMANENT"],
+                config["SESSION_COMPRESS"],
+                serializer,
             )
         else:
-            session_interface = NullSessionInterface()
+            return NullSessionInterface()
 
+        session_interface._bind_app(app)
         return session_interface
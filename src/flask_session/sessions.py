@@ -1,44 +1,242 @@
-from copy import deepcopy
+from contextlib import nullcontext
+from functools import lru_cache
+import hashlib
+import pickle
+import secrets
 import sys
 import time
-from datetime import datetime
-from uuid import uuid4
-
-try:
-    import cPickle as pickle
-except ImportError:
-    import pickle
+from datetime import date, datetime
+from uuid import UUID
 
+import msgpack
 from flask.sessions import SessionInterface as FlaskSessionInterface
 from flask.sessions import SessionMixin
-from werkzeug.datastructures import CallbackDict
 from itsdangerous import Signer, BadSignature, want_bytes
+from markupsafe import Markup
+
+
+#: Exceptions raised when stored session data cannot be loaded, in which case
+#: a new session is started instead.
+LOAD_ERRORS = (
+    msgpack.UnpackException,
+    pickle.UnpicklingError,
+    EOFError,
+    ValueError,
+    TypeError,
+    AttributeError,
+    ImportError,
+    IndexError,
+    KeyError,
+    OverflowError,
+    MemoryError,
+)
+
+
+class MsgPackSerializer(object):
+    """Serializes session data with msgpack.
+
+    Tuples, sets, :class:`~markupsafe.Markup`, :class:`~uuid.UUID`,
+    :class:`~datetime.datetime` and :class:`~datetime.date` values are
+    stored as msgpack extension types, so they keep their type like they
+    do in Flask's cookie sessions.  Other values that msgpack cannot
+    represent raise :exc:`TypeError`; use :class:`PickleSerializer` for
+    sessions that hold them.
+
+    Values written by older versions are pickles, so :meth:`loads` falls
+    back to :mod:`pickle` for them.  A pickle starts with either the
+    ``PROTO`` opcode (``0x80``, protocol 2 and up) or ``(`` (protocol 0),
+    and is always longer than one byte; the only msgpack payloads that
+    start with those bytes are the empty map and the integer 40, which
+    are exactly one byte long.
+    """
 
+    ext_tuple = 1
+    ext_set = 2
+    ext_frozenset = 3
+    ext_markup = 4
+    ext_uuid = 5
+    ext_datetime = 6
+    ext_date = 7
+
+    def dumps(self, obj):
+        # strict_types makes msgpack hand subclasses such as sessions and
+        # Markup to _default instead of packing them as their base type.
+        return msgpack.packb(
+            obj, use_bin_type=True, strict_types=True, default=self._default
+        )
 
-PY2 = sys.version_info[0] == 2
-if not PY2:
-    text_type = str
-else:
-    text_type = unicode
+    def loads(self, val):
+        if len(val) > 1 and val[:1] in (b"\x80", b"("):
+            return pickle.loads(val)
+        return self._unpack(val)
 
+    def _unpack(self, val):
+        return msgpack.unpackb(
+            val, raw=False, strict_map_key=False, ext_hook=self._ext_hook
+        )
 
-def total_seconds(td):
-    return td.days * 60 * 60 * 24 + td.seconds
+    def _default(self, obj):
+        if isinstance(obj, dict):
+            return dict(obj)
+        if isinstance(obj, tuple):
+            return msgpack.ExtType(self.ext_tuple, self.dumps(list(obj)))
+        if isinstance(obj, frozenset):
+            return msgpack.ExtType(self.ext_frozenset, self.dumps(list(obj)))
+        if isinstance(obj, set):
+            return msgpack.ExtType(self.ext_set, self.dumps(list(obj)))
+        if isinstance(obj, Markup):
+            return msgpack.ExtType(self.ext_markup, str(obj).encode("utf-8"))
+        if isinstance(obj, UUID):
+            return msgpack.ExtType(self.ext_uuid, obj.bytes)
+        if isinstance(obj, datetime):
+            return msgpack.ExtType(self.ext_datetime, obj.isoformat().encode())
+        if isinstance(obj, date):
+            return msgpack.ExtType(self.ext_date, obj.isoformat().encode())
+        # Other subclasses of types msgpack supports are stored as their
+        # base type, e.g. an IntEnum member as an int.
+        for base in (int, float, str, bytes, list):
+            if isinstance(obj, base):
+                return base(obj)
+        raise TypeError(
+            f"Object of type {type(obj).__name__} cannot be stored in the session"
+        )
 
+    def _ext_hook(self, code, data):
+        if code == self.ext_tuple:
+            return tuple(self._unpack(data))
+        if code == self.ext_set:
+            return set(self._unpack(data))
+        if code == self.ext_frozenset:
+            return frozenset(self._unpack(data))
+        if code == self.ext_markup:
+            return Markup(data.decode("utf-8"))
+        if code == self.ext_uuid:
+            return UUID(bytes=data)
+        if code == self.ext_datetime:
+            return datetime.fromisoformat(data.decode())
+        if code == self.ext_date:
+            return date.fromisoformat(data.decode())
+        return msgpack.ExtType(code, data)
+
+
+class PickleSerializer(object):
+    """Serializes session data with :mod:`pickle`, using the highest
+    protocol available.  Set it as the ``serializer`` of an interface if
+    sessions hold values that msgpack cannot represent.
+    """
 
-class ServerSideSession(CallbackDict, SessionMixin):
-    """Baseclass for server-side based sessions."""
+    def dumps(self, obj):
+        return pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, val):
+        return pickle.loads(val)
+
+
+class ZstdSerializer(object):
+    """Wraps another serializer and compresses its output with zstd.
+
+    Values that do not start with the zstd frame magic number are passed to
+    the wrapped serializer unchanged, so sessions stored before compression
+    was enabled can still be loaded.
+
+    :param serializer: The serializer whose output is compressed.
+    :param level: The zstd compression level.
+    """
+
+    magic = b"\x28\xb5\x2f\xfd"
+
+    def __init__(self, serializer, level=3):
+        import zstandard
+
+        # ``ZstdCompressor`` instances must not be shared between threads,
+        # so use the one-shot module functions instead.
+        self.zstandard = zstandard
+        self.serializer = serializer
+        self.level = level
+
+    def dumps(self, obj):
+        return self._compress(self.serializer.dumps(obj))
+
+    def loads(self, val):
+        return self.serializer.loads(self._decompress(val))
+
+    def _compress(self, val):
+        return self.zstandard.compress(val, self.level)
+
+    def _decompress(self, val):
+        if val[:4] != self.magic:
+            return val
+        try:
+            return self.zstandard.decompress(val)
+        except self.zstandard.ZstdError as e:
+            raise ValueError(str(e)) from e
 
-    def __init__(self, initial=None, sid=None, permanent=None):
-        def on_update(self):
-            self.modified = True
 
-        CallbackDict.__init__(self, initial, on_update)
+@lru_cache(maxsize=8)
+def _create_signer(secret_key):
+    return Signer(secret_key, salt="flask-session", key_derivation="hmac")
+
+
+_missing = object()
+
+
+class ServerSideSession(dict, SessionMixin):
+    """Baseclass for server-side based sessions.
+
+    The methods that mutate the session set :attr:`modified` directly,
+    which is cheaper than the callback of
+    :class:`~werkzeug.datastructures.CallbackDict` used before.
+    """
+
+    #: A digest of the serialized data the session was loaded from, used to
+    #: tell whether it changed.  Set by the session interface after the
+    #: session is created.
+    digest = None
+
+    def __init__(self, initial=None, sid=None, permanent=None):
+        dict.__init__(self, initial or ())
         self.sid = sid
         if permanent:
             self.permanent = permanent
         self.modified = False
-        self.initial = {} if initial is None else deepcopy(initial)
+
+    def __setitem__(self, key, value):
+        self.modified = True
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self.modified = True
+        dict.__delitem__(self, key)
+
+    if sys.version_info >= (3, 9):
+
+        def __ior__(self, other):
+            self.modified = True
+            return dict.__ior__(self, other)
+
+    def clear(self):
+        self.modified = True
+        dict.clear(self)
+
+    def pop(self, key, default=_missing):
+        if key in self:
+            self.modified = True
+        if default is _missing:
+            return dict.pop(self, key)
+        return dict.pop(self, key, default)
+
+    def popitem(self):
+        self.modified = True
+        return dict.popitem(self)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self.modified = True
+        return dict.setdefault(self, key, default)
+
+    def update(self, *args, **kwargs):
+        self.modified = True
+        dict.update(self, *args, **kwargs)
 
 
 class RedisSession(ServerSideSession):
@@ -62,13 +260,15 @@ class SqlAlchemySession(ServerSideSession):
 
 
 class SessionInterface(FlaskSessionInterface):
+    _cookie_name = None
+
     def _generate_sid(self):
-        return str(uuid4())
+        return secrets.token_urlsafe(16)
 
     def _get_signer(self, app):
         if not hasattr(app, "secret_key") or not app.secret_key:
             raise KeyError("SECRET_KEY must be set when SESSION_USE_SIGNER=True")
-        return Signer(app.secret_key, salt="flask-session", key_derivation="hmac")
+        return _create_signer(app.secret_key)
 
     def _unsign(self, app, sid):
         signer = self._get_signer(app)
@@ -81,6 +281,49 @@ class SessionInterface(FlaskSessionInterface):
         sid_as_bytes = want_bytes(sid)
         return signer.sign(sid_as_bytes).decode("utf-8")
 
+    def _bind_app(self, app):
+        """Read the session cookie settings from the app config, so that
+        they don't have to be looked up on every request.  The config must
+        not be modified after ``init_app``.
+        """
+        self._cookie_name = app.config["SESSION_COOKIE_NAME"]
+        self._refresh_each_request = app.config["SESSION_REFRESH_EACH_REQUEST"]
+        self._cookie_attrs = {
+            "domain": self.get_cookie_domain(app),
+            "path": self.get_cookie_path(app),
+            "httponly": self.get_cookie_httponly(app),
+            "secure": self.get_cookie_secure(app),
+            "samesite": self.get_cookie_samesite(app),
+        }
+
+    def _digest(self, val):
+        """Return a digest of the serialized session data, which is used to
+        tell whether the session changed when it is saved.  Returns ``None``
+        if saves are never skipped, see :meth:`_is_unchanged`.
+        """
+        if self._refresh_each_request:
+            return None
+        return hashlib.blake2b(val, digest_size=16).digest()
+
+    def _is_unchanged(self, session, val):
+        """Check whether saving the serialized session `val` can be skipped
+        because its contents did not change and the write is not needed to
+        extend its expiry in the backend either.
+
+        Every save extends the backend expiry, so it can only be skipped
+        for permanent sessions with ``SESSION_REFRESH_EACH_REQUEST``
+        disabled; a non-permanent session would expire in the backend
+        while it is still in use.  The serialized data is compared as well
+        because mutating a nested value does not mark the session as
+        modified.
+        """
+        return (
+            session.digest is not None
+            and session.permanent
+            and not session.modified
+            and session.digest == self._digest(val)
+        )
+
 
 class NullSessionInterface(SessionInterface):
     """Used to open a :class:`flask.sessions.NullSession` instance."""
@@ -99,24 +342,49 @@ class RedisSessionInterface(SessionInterface):
     :param key_prefix: A prefix that is added to all Redis store keys.
     :param use_signer: Whether to sign the session id cookie or not.
     :param permanent: Whether to use permanent session or not.
+    :param compress: Whether to compress the stored session data with zstd.
+    :param pool_size: The maximum number of connections kept by the default
+                      client when `redis` is ``None``.
+    :param serializer: The serializer used to store the session data,
+                       defaults to :class:`MsgPackSerializer`.
     """
 
-    serializer = pickle
+    serializer = MsgPackSerializer()
     session_class = RedisSession
 
-    def __init__(self, redis, key_prefix, use_signer=False, permanent=True):
+    def __init__(
+        self,
+        redis,
+        key_prefix,
+        use_signer=False,
+        permanent=True,
+        compress=False,
+        pool_size=64,
+        serializer=None,
+    ):
         if redis is None:
-            from redis import Redis
-
-            redis = Redis()
+            from redis import BlockingConnectionPool, Redis
+
+            pool = BlockingConnectionPool(
+                max_connections=pool_size,
+                socket_keepalive=True,
+                health_check_interval=30,
+            )
+            redis = Redis(connection_pool=pool)
         self.redis = redis
         self.key_prefix = key_prefix
+        self._key_prefix_bytes = key_prefix.encode("utf-8")
         self.use_signer = use_signer
         self.permanent = permanent
-        self.has_same_site_capability = hasattr(self, "get_cookie_samesite")
+        if serializer is not None:
+            self.serializer = serializer
+        if compress:
+            self.serializer = ZstdSerializer(self.serializer)
 
     def open_session(self, app, request):
-        sid = request.cookies.get(app.config["SESSION_COOKIE_NAME"])
+        if self._cookie_name is None:
+            self._bind_app(app)
+        sid = request.cookies.get(self._cookie_name)
         if not sid:
             sid = self._generate_sid()
             return self.session_class(sid=sid, permanent=self.permanent)
@@ -127,25 +395,26 @@ class RedisSessionInterface(SessionInterface):
                 sid = self._generate_sid()
                 return self.session_class(sid=sid, permanent=self.permanent)
 
-        if not PY2 and not isinstance(sid, text_type):
-            sid = sid.decode("utf-8", "strict")
-        val = self.redis.get(self.key_prefix + sid)
+        val = self.redis.get(self._key_prefix_bytes + sid.encode("utf-8"))
         if val is not None:
             try:
                 data = self.serializer.loads(val)
-                return self.session_class(data, sid=sid)
-            except:
+            except LOAD_ERRORS:
                 return self.session_class(sid=sid, permanent=self.permanent)
+            session = self.session_class(data, sid=sid)
+            session.digest = self._digest(val)
+            return session
         return self.session_class(sid=sid, permanent=self.permanent)
 
     def save_session(self, app, session, response):
-        domain = self.get_cookie_domain(app)
-        path = self.get_cookie_path(app)
+        cookie_attrs = self._cookie_attrs
         if not session:
             if session.modified:
-                self.redis.delete(self.key_prefix + session.sid)
+                self.redis.delete(self._key_prefix_bytes + session.sid.encode("utf-8"))
                 response.delete_cookie(
-                    app.config["SESSION_COOKIE_NAME"], domain=domain, path=path
+                    self._cookie_name,
+                    domain=cookie_attrs["domain"],
+                    path=cookie_attrs["path"],
                 )
             return
 
@@ -158,31 +427,24 @@ class RedisSessionInterface(SessionInterface):
         # the permanent flag on the session itself.
         # if not self.should_set_cookie(app, session):
         #    return
-        conditional_cookie_kwargs = {}
-        httponly = self.get_cookie_httponly(app)
-        secure = self.get_cookie_secure(app)
-        if self.has_same_site_capability:
-            conditional_cookie_kwargs["samesite"] = self.get_cookie_samesite(app)
-        expires = self.get_expiration_time(app, session)
         val = self.serializer.dumps(dict(session))
+        if self._is_unchanged(session, val):
+            return
+        expires = self.get_expiration_time(app, session)
         self.redis.setex(
-            name=self.key_prefix + session.sid,
+            name=self._key_prefix_bytes + session.sid.encode("utf-8"),
             value=val,
-            time=total_seconds(app.permanent_session_lifetime),
+            time=int(app.permanent_session_lifetime.total_seconds()),
         )
         if self.use_signer:
             session_id = self._sign(app, session.sid)
         else:
             session_id = session.sid
         response.set_cookie(
-            app.config["SESSION_COOKIE_NAME"],
+            self._cookie_name,
             session_id,
             expires=expires,
-            httponly=httponly,
-            domain=domain,
-            path=path,
-            secure=secure,
-            **conditional_cookie_kwargs,
+            **cookie_attrs,
         )
 
 
@@ -196,21 +458,43 @@ class MemcachedSessionInterface(SessionInterface):
     :param key_prefix: A prefix that is added to all Memcached store keys.
     :param use_signer: Whether to sign the session id cookie or not.
     :param permanent: Whether to use permanent session or not.
+    :param compress: Whether to compress the stored session data with zstd.
+    :param pool_size: The number of clones of the default pylibmc client
+                      kept for the request threads when `client` is
+                      ``None``.  Requests wait for a free clone when all
+                      of them are in use.
+    :param serializer: The serializer used to store the session data,
+                       defaults to :class:`MsgPackSerializer`.
     """
 
-    serializer = pickle
+    serializer = MsgPackSerializer()
     session_class = MemcachedSession
 
-    def __init__(self, client, key_prefix, use_signer=False, permanent=True):
+    def __init__(
+        self,
+        client,
+        key_prefix,
+        use_signer=False,
+        permanent=True,
+        compress=False,
+        pool_size=16,
+        serializer=None,
+    ):
+        self.pool = None
+        self.pool_size = pool_size
         if client is None:
             client = self._get_preferred_memcache_client()
             if client is None:
                 raise RuntimeError("no memcache module found")
         self.client = client
         self.key_prefix = key_prefix
+        self._key_prefix_bytes = key_prefix.encode("utf-8")
         self.use_signer = use_signer
         self.permanent = permanent
-        self.has_same_site_capability = hasattr(self, "get_cookie_samesite")
+        if serializer is not None:
+            self.serializer = serializer
+        if compress:
+            self.serializer = ZstdSerializer(self.serializer)
 
     def _get_preferred_memcache_client(self):
         servers = ["127.0.0.1:11211"]
@@ -219,7 +503,13 @@ class MemcachedSessionInterface(SessionInterface):
         except ImportError:
             pass
         else:
-            return pylibmc.Client(servers)
+            client = pylibmc.Client(
+                servers, binary=True, behaviors={"tcp_nodelay": True, "ketama": True}
+            )
+            # pylibmc clients must not be shared between threads, so hand out
+            # clones of it from a pool.
+            self.pool = pylibmc.ClientPool(client, self.pool_size)
+            return client
 
         try:
             import memcache
@@ -228,6 +518,14 @@ class MemcachedSessionInterface(SessionInterface):
         else:
             return memcache.Client(servers)
 
+    def _reserve_client(self):
+        """Return a context manager that provides a client to use in the
+        current thread.
+        """
+        if self.pool is None:
+            return nullcontext(self.client)
+        return self.pool.reserve(block=True)
+
     def _get_memcache_timeout(self, timeout):
         """
         Memcached deals with long (> 30 days) timeouts in a special
@@ -244,7 +542,9 @@ class MemcachedSessionInterface(SessionInterface):
         return timeout
 
     def open_session(self, app, request):
-        sid = request.cookies.get(app.config["SESSION_COOKIE_NAME"])
+        if self._cookie_name is None:
+            self._bind_app(app)
+        sid = request.cookies.get(self._cookie_name)
         if not sid:
             sid = self._generate_sid()
             return self.session_class(sid=sid, permanent=self.permanent)
@@ -255,62 +555,52 @@ class MemcachedSessionInterface(SessionInterface):
                 sid = self._generate_sid()
                 return self.session_class(sid=sid, permanent=self.permanent)
 
-        full_session_key = self.key_prefix + sid
-        if PY2 and isinstance(full_session_key, unicode):
-            full_session_key = full_session_key.encode("utf-8")
-        val = self.client.get(full_session_key)
+        full_session_key = self._key_prefix_bytes + sid.encode("utf-8")
+        with self._reserve_client() as client:
+            val = client.get(full_session_key)
         if val is not None:
             try:
-                if not PY2:
-                    val = want_bytes(val)
+                val = want_bytes(val)
                 data = self.serializer.loads(val)
-                return self.session_class(data, sid=sid)
-            except:
+            except LOAD_ERRORS:
                 return self.session_class(sid=sid, permanent=self.permanent)
+            session = self.session_class(data, sid=sid)
+            session.digest = self._digest(val)
+            return session
         return self.session_class(sid=sid, permanent=self.permanent)
 
     def save_session(self, app, session, response):
-        domain = self.get_cookie_domain(app)
-        path = self.get_cookie_path(app)
-        full_session_key = self.key_prefix + session.sid
-        if PY2 and isinstance(full_session_key, unicode):
-            full_session_key = full_session_key.encode("utf-8")
+        cookie_attrs = self._cookie_attrs
+        full_session_key = self._key_prefix_bytes + session.sid.encode("utf-8")
         if not session:
             if session.modified:
-                self.client.delete(full_session_key)
+                with self._reserve_client() as client:
+                    client.delete(full_session_key)
                 response.delete_cookie(
-                    app.config["SESSION_COOKIE_NAME"], domain=domain, path=path
+                    self._cookie_name,
+                    domain=cookie_attrs["domain"],
+                    path=cookie_attrs["path"],
                 )
             return
 
-        conditional_cookie_kwargs = {}
-        httponly = self.get_cookie_httponly(app)
-        secure = self.get_cookie_secure(app)
-        if self.has_same_site_capability:
-            conditional_cookie_kwargs["samesite"] = self.get_cookie_samesite(app)
+        val = self.serializer.dumps(dict(session))
+        if self._is_unchanged(session, val):
+            return
         expires = self.get_expiration_time(app, session)
-        if not PY2:
-            val = self.serializer.dumps(dict(session), 0)
-        else:
-            val = self.serializer.dumps(dict(session))
-        self.client.set(
-            full_session_key,
-            val,
-            self._get_memcache_timeout(total_seconds(app.permanent_session_lifetime)),
+        timeout = self._get_memcache_timeout(
+            int(app.permanent_session_lifetime.total_seconds())
         )
+        with self._reserve_client() as client:
+            client.set(full_session_key, val, timeout)
         if self.use_signer:
             session_id = self._sign(app, session.sid)
         else:
             session_id = session.sid
         response.set_cookie(
-            app.config["SESSION_COOKIE_NAME"],
+            self._cookie_name,
             session_id,
             expires=expires,
-            httponly=httponly,
-            domain=domain,
-            path=path,
-            secure=secure,
-            **conditional_cookie_kwargs,
+            **cookie_attrs,
         )
 
 
@@ -340,10 +630,11 @@ class FileSystemSessionInterface(SessionInterface):
         self.key_prefix = key_prefix
         self.use_signer = use_signer
         self.permanent = permanent
-        self.has_same_site_capability = hasattr(self, "get_cookie_samesite")
 
     def open_session(self, app, request):
-        sid = request.cookies.get(app.config["SESSION_COOKIE_NAME"])
+        if self._cookie_name is None:
+            self._bind_app(app)
+        sid = request.cookies.get(self._cookie_name)
         if not sid:
             sid = self._generate_sid()
             return self.session_class(sid=sid, permanent=self.permanent)
@@ -356,45 +647,47 @@ class FileSystemSessionInterface(SessionInterface):
 
         data = self.cache.get(self.key_prefix + sid)
         if data is not None:
-            return self.session_class(data, sid=sid)
+            session = self.session_class(data, sid=sid)
+            if not self._refresh_each_request:
+                session.digest = self._digest(
+                    pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+                )
+            return session
         return self.session_class(sid=sid, permanent=self.permanent)
 
     def save_session(self, app, session, response):
-        domain = self.get_cookie_domain(app)
-        path = self.get_cookie_path(app)
+        cookie_attrs = self._cookie_attrs
         if not session:
             if session.modified:
                 self.cache.delete(self.key_prefix + session.sid)
                 response.delete_cookie(
-                    app.config["SESSION_COOKIE_NAME"], domain=domain, path=path
+                    self._cookie_name,
+                    domain=cookie_attrs["domain"],
+                    path=cookie_attrs["path"],
                 )
             return
 
-        conditional_cookie_kwargs = {}
-        httponly = self.get_cookie_httponly(app)
-        secure = self.get_cookie_secure(app)
-        if self.has_same_site_capability:
-            conditional_cookie_kwargs["samesite"] = self.get_cookie_samesite(app)
-        expires = self.get_expiration_time(app, session)
         data = dict(session)
+        # cachelib pickles the data itself, so compare a pickle of it.
+        if session.digest is not None and self._is_unchanged(
+            session, pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+        ):
+            return
+        expires = self.get_expiration_time(app, session)
         self.cache.set(
             self.key_prefix + session.sid,
             data,
-            total_seconds(app.permanent_session_lifetime),
+            int(app.permanent_session_lifetime.total_seconds()),
         )
         if self.use_signer:
             session_id = self._sign(app, session.sid)
         else:
             session_id = session.sid
         response.set_cookie(
-            app.config["SESSION_COOKIE_NAME"],
+            self._cookie_name,
             session_id,
             expires=expires,
-            httponly=httponly,
-            domain=domain,
-            path=path,
-            secure=secure,
-            **conditional_cookie_kwargs,
+            **cookie_attrs,
         )
 
 
@@ -410,27 +703,64 @@ class MongoDBSessionInterface(SessionInterface):
     :param key_prefix: A prefix that is added to all MongoDB store keys.
     :param use_signer: Whether to sign the session id cookie or not.
     :param permanent: Whether to use permanent session or not.
+    :param compress: Whether to compress the stored session data with zstd.
+    :param serializer: The serializer used to store the session data,
+                       defaults to :class:`MsgPackSerializer`.
     """
 
-    serializer = pickle
+    serializer = MsgPackSerializer()
     session_class = MongoDBSession
 
     def __init__(
-        self, client, db, collection, key_prefix, use_signer=False, permanent=True
+        self,
+        client,
+        db,
+        collection,
+        key_prefix,
+        use_signer=False,
+        permanent=True,
+        compress=False,
+        serializer=None,
     ):
         if client is None:
             from pymongo import MongoClient
 
-            client = MongoClient()
+            client = MongoClient(minPoolSize=5)
         self.client = client
         self.store = client[db][collection]
+        self._indexes_created = False
         self.key_prefix = key_prefix
         self.use_signer = use_signer
         self.permanent = permanent
-        self.has_same_site_capability = hasattr(self, "get_cookie_samesite")
+        if serializer is not None:
+            self.serializer = serializer
+        if compress:
+            self.serializer = ZstdSerializer(self.serializer)
+
+    def _create_indexes(self, app):
+        """Index the session id and let a TTL index delete expired sessions.
+
+        This is done when the first session is saved rather than in
+        ``__init__``, so that the app can start while MongoDB is down.  If
+        the indexes cannot be created, for example because the user lacks
+        the ``createIndex`` privilege or an index on ``expiration`` already
+        exists with other options, a warning is logged and sessions are
+        stored anyway.  Expired sessions are still not loaded, but they
+        are no longer deleted from the collection.
+        """
+        from pymongo.errors import OperationFailure
+
+        try:
+            self.store.create_index("id")
+            self.store.create_index("expiration", expireAfterSeconds=0)
+        except OperationFailure as e:
+            app.logger.warning("Could not create the session indexes: %s", e)
+        self._indexes_created = True
 
     def open_session(self, app, request):
-        sid = request.cookies.get(app.config["SESSION_COOKIE_NAME"])
+        if self._cookie_name is None:
+            self._bind_app(app)
+        sid = request.cookies.get(self._cookie_name)
         if not sid:
             sid = self._generate_sid()
             return self.session_class(sid=sid, permanent=self.permanent)
@@ -442,55 +772,61 @@ class MongoDBSessionInterface(SessionInterface):
                 return self.session_class(sid=sid, permanent=self.permanent)
 
         store_id = self.key_prefix + sid
-        document = self.store.find_one({"id": store_id})
-        if document and document.get("expiration") <= datetime.utcnow():
-            # Delete expired session
-            self.store.remove({"id": store_id})
-            document = None
+        # The TTL index only removes expired sessions about once a minute,
+        # so skip the ones it has not got to yet.
+        document = self.store.find_one(
+            {
+                "id": store_id,
+                "$or": [
+                    {"expiration": {"$gt": datetime.utcnow()}},
+                    {"expiration": None},
+                ],
+            }
+        )
         if document is not None:
             try:
-                val = document["val"]
-                data = self.serializer.loads(want_bytes(val))
-                return self.session_class(data, sid=sid)
-            except:
+                val = want_bytes(document["val"])
+                data = self.serializer.loads(val)
+            except LOAD_ERRORS:
                 return self.session_class(sid=sid, permanent=self.permanent)
+            session = self.session_class(data, sid=sid)
+            session.digest = self._digest(val)
+            return session
         return self.session_class(sid=sid, permanent=self.permanent)
 
     def save_session(self, app, session, response):
-        domain = self.get_cookie_domain(app)
-        path = self.get_cookie_path(app)
+        cookie_attrs = self._cookie_attrs
         store_id = self.key_prefix + session.sid
         if not session:
             if session.modified:
-                self.store.remove({"id": store_id})
+                self.store.delete_one({"id": store_id})
                 response.delete_cookie(
-                    app.config["SESSION_COOKIE_NAME"], domain=domain, path=path
+                    self._cookie_name,
+                    domain=cookie_attrs["domain"],
+                    path=cookie_attrs["path"],
                 )
             return
 
-        conditional_cookie_kwargs = {}
-        httponly = self.get_cookie_httponly(app)
-        secure = self.get_cookie_secure(app)
-        if self.has_same_site_capability:
-            conditional_cookie_kwargs["samesite"] = self.get_cookie_samesite(app)
-        expires = self.get_expiration_time(app, session)
         val = self.serializer.dumps(dict(session))
-        self.store.update(
-            {"id": store_id}, {"id": store_id, "val": val, "expiration": expires}, True
+        if self._is_unchanged(session, val):
+            return
+        if not self._indexes_created:
+            self._create_indexes(app)
+        expires = self.get_expiration_time(app, session)
+        self.store.replace_one(
+            {"id": store_id},
+            {"id": store_id, "val": val, "expiration": expires},
+            upsert=True,
         )
         if self.use_signer:
             session_id = self._sign(app, session.sid)
         else:
             session_id = session.sid
         response.set_cookie(
-            app.config["SESSION_COOKIE_NAME"],
+            self._cookie_name,
             session_id,
             expires=expires,
-            httponly=httponly,
-            domain=domain,
-            path=path,
-            secure=secure,
-            **conditional_cookie_kwargs,
+            **cookie_attrs,
         )
 
 
@@ -505,12 +841,25 @@ class SqlAlchemySessionInterface(SessionInterface):
     :param key_prefix: A prefix that is added to all store keys.
     :param use_signer: Whether to sign the session id cookie or not.
     :param permanent: Whether to use permanent session or not.
+    :param compress: Whether to compress the stored session data with zstd.
+    :param serializer: The serializer used to store the session data,
+                       defaults to :class:`MsgPackSerializer`.
     """
 
-    serializer = pickle
+    serializer = MsgPackSerializer()
     session_class = SqlAlchemySession
 
-    def __init__(self, app, db, table, key_prefix, use_signer=False, permanent=True):
+    def __init__(
+        self,
+        app,
+        db,
+        table,
+        key_prefix,
+        use_signer=False,
+        permanent=True,
+        compress=False,
+        serializer=None,
+    ):
         if db is None:
             from flask_sqlalchemy import SQLAlchemy
 
@@ -519,31 +868,26 @@ class SqlAlchemySessionInterface(SessionInterface):
         self.key_prefix = key_prefix
         self.use_signer = use_signer
         self.permanent = permanent
-        self.has_same_site_capability = hasattr(self, "get_cookie_samesite")
+        if serializer is not None:
+            self.serializer = serializer
+        if compress:
+            self.serializer = ZstdSerializer(self.serializer)
 
         class Session(self.db.Model):
             __tablename__ = table
 
             id = self.db.Column(self.db.Integer, primary_key=True)
             session_id = self.db.Column(self.db.String(255), unique=True)
+            data = self.db.Column(self.db.LargeBinary)
             expiry = self.db.Column(self.db.DateTime)
 
-        class SessionData(self.db.Model):
-            __tablename__ = table + "_data"
-
-            id = self.db.Column(self.db.Integer,
-                                self.db.ForeignKey(table + ".id",
-                                                   ondelete='cascade'),
-                                primary_key=True)
-            key = self.db.Column(self.db.String(255), primary_key=True)
-            value = self.db.Column(self.db.LargeBinary)
-
         # self.db.create_all()
         self.sql_session_model = Session
-        self.sql_session_data_model = SessionData
 
     def open_session(self, app, request):
-        sid = request.cookies.get(app.config["SESSION_COOKIE_NAME"])
+        if self._cookie_name is None:
+            self._bind_app(app)
+        sid = request.cookies.get(self._cookie_name)
         if not sid:
             sid = self._generate_sid()
             return self.session_class(sid=sid, permanent=self.permanent)
@@ -567,69 +911,52 @@ class SqlAlchemySessionInterface(SessionInterface):
             saved_session = None
         if saved_session:
             try:
-                data = {
-                    row.key: self.serializer.loads(want_bytes(row.value))
-                    for row in self.sql_session_data_model.query.filter_by(
-                        id=saved_session.id)
-                }
-                return self.session_class(data, sid=sid)
-            except:
+                val = want_bytes(saved_session.data)
+                data = self.serializer.loads(val)
+            except LOAD_ERRORS:
                 return self.session_class(sid=sid, permanent=self.permanent)
+            session = self.session_class(data, sid=sid)
+            session.digest = self._digest(val)
+            return session
         return self.session_class(sid=sid, permanent=self.permanent)
 
     def save_session(self, app, session, response):
-        domain = self.get_cookie_domain(app)
-        path = self.get_cookie_path(app)
+        cookie_attrs = self._cookie_attrs
         store_id = self.key_prefix + session.sid
-        saved_session = self.sql_session_model.query.filter_by(
-            session_id=store_id
-        ).first()
         if not session:
             if session.modified:
+                saved_session = self.sql_session_model.query.filter_by(
+                    session_id=store_id
+                ).first()
                 if saved_session:
                     self.db.session.delete(saved_session)
                     self.db.session.commit()
                 response.delete_cookie(
-                    app.config["SESSION_COOKIE_NAME"], domain=domain, path=path
+                    self._cookie_name,
+                    domain=cookie_attrs["domain"],
+                    path=cookie_attrs["path"],
                 )
             return
 
-        conditional_cookie_kwargs = {}
-        httponly = self.get_cookie_httponly(app)
-        secure = self.get_cookie_secure(app)
-        if self.has_same_site_capability:
-            conditional_cookie_kwargs["samesite"] = self.get_cookie_samesite(app)
+        val = self.serializer.dumps(dict(session))
+        if self._is_unchanged(session, val):
+            return
         expires = self.get_expiration_time(app, session)
-        if saved_session:
-            saved_session.expiry = expires
-        else:
-            saved_session = self.sql_session_model(session_id=store_id,
-                                                   expiry=expires)
-            self.db.session.add(saved_session)
-            self.db.session.flush()
-        self.db.session.query(self.sql_session_data_model).filter(
-            self.sql_session_data_model.id == saved_session.id,
-            self.sql_session_data_model.key.in_(
-                session.initial.keys() - session.keys())).delete()
-        for key, value in session.items():
-            if session.initial.get(key) == value:
-                continue
-            self.db.session.merge(
-                self.sql_session_data_model(id=saved_session.id,
-                                            key=key,
-                                            value=self.serializer.dumps(value)))
+        updated = self.sql_session_model.query.filter_by(session_id=store_id).update(
+            {"data": val, "expiry": expires}
+        )
+        if not updated:
+            self.db.session.add(
+                self.sql_session_model(session_id=store_id, data=val, expiry=expires)
+            )
         self.db.session.commit()
         if self.use_signer:
             session_id = self._sign(app, session.sid)
         else:
             session_id = session.sid
         response.set_cookie(
-            app.config["SESSION_COOKIE_NAME"],
+            self._cookie_name,
             session_id,
             expires=expires,
-            httponly=httponly,
-            domain=domain,
-            path=path,
-            secure=secure,
-            **conditional_cookie_kwargs,
+            **cookie_attrs,
         )
@@ -1,8 +1,26 @@
+import datetime
+import decimal
+import pickle
+import sys
 import unittest
 import tempfile
+import uuid
+from unittest import mock
 
 import flask
+from markupsafe import Markup
 from flask_session import Session
+from flask_session.sessions import (
+    MsgPackSerializer,
+    PickleSerializer,
+    ServerSideSession,
+    ZstdSerializer,
+)
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 
 class FlaskSessionTestCase(unittest.TestCase):
@@ -71,6 +89,16 @@ class FlaskSessionTestCase(unittest.TestCase):
         self.assertEqual(c.get("/get").data, b"42")
         c.post("/delete")
 
+    def test_memcached_session_pool_size(self):
+        pylibmc = mock.Mock()
+        app = flask.Flask(__name__)
+        app.config["SESSION_TYPE"] = "memcached"
+        app.config["SESSION_MEMCACHED_POOL_SIZE"] = 32
+        with mock.patch.dict("sys.modules", pylibmc=pylibmc):
+            Session(app)
+        pylibmc.ClientPool.assert_called_once_with(pylibmc.Client.return_value, 32)
+        self.assertIs(app.session_interface.pool, pylibmc.ClientPool.return_value)
+
     def test_filesystem_session(self):
         app = flask.Flask(__name__)
         app.config["SESSION_TYPE"] = "filesystem"
@@ -96,6 +124,74 @@ class FlaskSessionTestCase(unittest.TestCase):
         self.assertEqual(c.get("/get").data, b"42")
         c.post("/delete")
 
+    def test_filesystem_session_unchanged(self):
+        app = flask.Flask(__name__)
+        app.config["SESSION_TYPE"] = "filesystem"
+        app.config["SESSION_FILE_DIR"] = tempfile.mkdtemp()
+        app.config["SESSION_REFRESH_EACH_REQUEST"] = False
+        Session(app)
+
+        @app.route("/set", methods=["POST"])
+        def set():
+            flask.session["value"] = [flask.request.form["value"]]
+            return "value set"
+
+        @app.route("/append", methods=["POST"])
+        def append():
+            flask.session["value"].append(flask.request.form["value"])
+            return "value appended"
+
+        @app.route("/get")
+        def get():
+            return ",".join(flask.session["value"])
+
+        def session_writes():
+            return [
+                call for call in cache_set.call_args_list
+                if call.args[0].startswith("session:")
+            ]
+
+        c = app.test_client()
+        cache = app.session_interface.cache
+        with mock.patch.object(cache, "set", wraps=cache.set) as cache_set:
+            self.assertEqual(c.post("/set", data={"value": "42"}).data, b"value set")
+            self.assertEqual(c.get("/get").data, b"42")
+            self.assertEqual(len(session_writes()), 1)
+            c.post("/append", data={"value": "43"})
+            self.assertEqual(len(session_writes()), 2)
+            self.assertEqual(c.get("/get").data, b"42,43")
+            self.assertEqual(len(session_writes()), 2)
+
+    def test_filesystem_session_non_permanent_refreshed(self):
+        app = flask.Flask(__name__)
+        app.config["SESSION_TYPE"] = "filesystem"
+        app.config["SESSION_FILE_DIR"] = tempfile.mkdtemp()
+        app.config["SESSION_PERMANENT"] = False
+        app.config["SESSION_REFRESH_EACH_REQUEST"] = False
+        Session(app)
+
+        @app.route("/set", methods=["POST"])
+        def set():
+            flask.session["value"] = flask.request.form["value"]
+            return "value set"
+
+        @app.route("/get")
+        def get():
+            return flask.session["value"]
+
+        c = app.test_client()
+        cache = app.session_interface.cache
+        with mock.patch.object(cache, "set", wraps=cache.set) as cache_set:
+            self.assertEqual(c.post("/set", data={"value": "42"}).data, b"value set")
+            self.assertEqual(c.get("/get").data, b"42")
+            self.assertEqual(c.get("/get").data, b"42")
+            # Reading a non-permanent session still extends its expiry.
+            writes = [
+                call for call in cache_set.call_args_list
+                if call.args[0].startswith("session:")
+            ]
+            self.assertEqual(len(writes), 3)
+
     def test_mongodb_session(self):
         app = flask.Flask(__name__)
         app.testing = True
@@ -121,6 +217,32 @@ class FlaskSessionTestCase(unittest.TestCase):
         self.assertEqual(c.get("/get").data, b"42")
         c.post("/delete")
 
+    def test_mongodb_session_indexes(self):
+        from pymongo.errors import OperationFailure
+
+        client = mock.MagicMock()
+        store = client["flask_session"]["sessions"]
+        store.find_one.return_value = None
+        store.create_index.side_effect = OperationFailure("IndexOptionsConflict")
+
+        app = flask.Flask(__name__)
+        app.config["SESSION_TYPE"] = "mongodb"
+        app.config["SESSION_MONGODB"] = client
+        Session(app)
+        store.create_index.assert_not_called()
+
+        @app.route("/set", methods=["POST"])
+        def set():
+            flask.session["value"] = flask.request.form["value"]
+            return "value set"
+
+        c = app.test_client()
+        with self.assertLogs(app.logger, "WARNING"):
+            self.assertEqual(c.post("/set", data={"value": "42"}).data, b"value set")
+        self.assertEqual(c.post("/set", data={"value": "43"}).data, b"value set")
+        self.assertEqual(store.create_index.call_count, 1)
+        self.assertEqual(store.replace_one.call_count, 2)
+
     def test_flasksqlalchemy_session(self):
         app = flask.Flask(__name__)
         app.debug = True
@@ -195,6 +317,240 @@ class FlaskSessionTestCase(unittest.TestCase):
         self.assertEqual(c.post("/set", data={"value": "42"}).data, b"value set")
         self.assertEqual(c.get("/get").data, b"42")
 
+    def test_session_modified(self):
+        def session():
+            return ServerSideSession({"value": "42", "n": 42}, sid="sid")
+
+        unmodified = [
+            lambda s: s.pop("missing", None),
+            lambda s: s.setdefault("value", "43"),
+            lambda s: s.get("value"),
+        ]
+        modified = [
+            lambda s: s.__setitem__("value", "43"),
+            lambda s: s.__delitem__("value"),
+            lambda s: s.pop("value"),
+            lambda s: s.popitem(),
+            lambda s: s.setdefault("other", "43"),
+            lambda s: s.update(other="43"),
+            lambda s: s.clear(),
+        ]
+        for op in unmodified:
+            s = session()
+            op(s)
+            self.assertFalse(s.modified)
+        for op in modified:
+            s = session()
+            op(s)
+            self.assertTrue(s.modified)
+
+        s = session()
+        with self.assertRaises(KeyError):
+            s.pop("missing")
+        self.assertFalse(s.modified)
+
+    @unittest.skipIf(sys.version_info < (3, 9), "dict |= requires Python 3.9")
+    def test_session_modified_ior(self):
+        s = ServerSideSession({"value": "42"}, sid="sid")
+        s |= {"other": "43"}
+        self.assertTrue(s.modified)
+        self.assertIsInstance(s, ServerSideSession)
+        self.assertEqual(s["other"], "43")
+
+    def test_msgpack_serializer(self):
+        serializer = MsgPackSerializer()
+        for data in ({}, {"value": "42"}, {"value": b"\x80\x04"}):
+            self.assertEqual(serializer.loads(serializer.dumps(data)), data)
+            # Sessions pickled by older versions can still be loaded.
+            self.assertEqual(serializer.loads(pickle.dumps(data)), data)
+            self.assertEqual(serializer.loads(pickle.dumps(data, 0)), data)
+        session = ServerSideSession({"value": "42"}, sid="sid")
+        self.assertEqual(serializer.dumps(session), serializer.dumps(dict(session)))
+        data = {"cart": {123: 2, 456: 1}}
+        self.assertEqual(serializer.loads(serializer.dumps(data)), data)
+
+    def test_msgpack_serializer_types(self):
+        serializer = MsgPackSerializer()
+        data = {
+            "tuple": (1, ("2", 3)),
+            "set": {1, 2},
+            "frozenset": frozenset(["a"]),
+            "markup": Markup("<b>saved</b>"),
+            "uuid": uuid.uuid4(),
+            "datetime": datetime.datetime(
+                2020, 1, 2, 3, 4, 5, 6, datetime.timezone.utc
+            ),
+            "date": datetime.date(2020, 1, 2),
+            "_flashes": [("message", Markup("<b>saved</b>"))],
+        }
+        loaded = serializer.loads(serializer.dumps(data))
+        self.assertEqual(loaded, data)
+        for key, value in data.items():
+            self.assertIs(type(loaded[key]), type(value))
+        self.assertIs(type(loaded["_flashes"][0][1]), Markup)
+        with self.assertRaises(TypeError):
+            serializer.dumps({"value": object()})
+
+    def test_pickle_serializer(self):
+        serializer = PickleSerializer()
+        val = serializer.dumps({"value": ("42", 42)})
+        self.assertEqual(val[1], pickle.HIGHEST_PROTOCOL)
+        data = serializer.loads(val)
+        self.assertIs(type(data), dict)
+        self.assertEqual(data, {"value": ("42", 42)})
+
+    @unittest.skipIf(zstandard is None, "zstandard is not installed")
+    def test_session_serializer(self):
+        store = {}
+        client = mock.Mock()
+        client.get.side_effect = store.get
+        client.setex.side_effect = lambda name, value, time: store.update(
+            {name: value}
+        )
+
+        app = flask.Flask(__name__)
+        app.config["SESSION_TYPE"] = "redis"
+        app.config["SESSION_REDIS"] = client
+        app.config["SESSION_SERIALIZER"] = "pickle"
+        app.config["SESSION_COMPRESS"] = True
+        Session(app)
+        serializer = app.session_interface.serializer
+        self.assertIsInstance(serializer, ZstdSerializer)
+        self.assertIsInstance(serializer.serializer, PickleSerializer)
+
+        @app.route("/set", methods=["POST"])
+        def set():
+            flask.session["value"] = decimal.Decimal(flask.request.form["value"])
+            return "value set"
+
+        @app.route("/get")
+        def get():
+            return repr(flask.session["value"])
+
+        c = app.test_client()
+        self.assertEqual(c.post("/set", data={"value": "4.2"}).data, b"value set")
+        self.assertEqual(c.get("/get").data, b"Decimal('4.2')")
+
+    def test_session_lifetime(self):
+        client = mock.Mock()
+        client.get.return_value = None
+
+        app = flask.Flask(__name__)
+        app.config["SESSION_TYPE"] = "redis"
+        app.config["SESSION_REDIS"] = client
+        Session(app)
+        # The lifetime may still be changed after the extension is set up.
+        app.permanent_session_lifetime = datetime.timedelta(days=90)
+
+        @app.route("/set", methods=["POST"])
+        def set():
+            flask.session["value"] = flask.request.form["value"]
+            return "value set"
+
+        c = app.test_client()
+        self.assertEqual(c.post("/set", data={"value": "42"}).data, b"value set")
+        self.assertEqual(client.setex.call_args[1]["time"], 90 * 24 * 60 * 60)
+
+    def test_session_class(self):
+        store = {}
+        client = mock.Mock()
+        client.get.side_effect = store.get
+        client.setex.side_effect = lambda name, value, time: store.update(
+            {name: value}
+        )
+
+        class CustomSession(ServerSideSession):
+            def __init__(self, initial=None, sid=None, permanent=None):
+                super().__init__(initial, sid, permanent)
+
+        app = flask.Flask(__name__)
+        app.testing = True
+        app.config["SESSION_TYPE"] = "redis"
+        app.config["SESSION_REDIS"] = client
+        app.config["SESSION_REFRESH_EACH_REQUEST"] = False
+        Session(app)
+        app.session_interface.session_class = CustomSession
+
+        @app.route("/set", methods=["POST"])
+        def set():
+            flask.session["value"] = flask.request.form["value"]
+            return "value set"
+
+        @app.route("/get")
+        def get():
+            return flask.session["value"]
+
+        c = app.test_client()
+        self.assertEqual(c.post("/set", data={"value": "42"}).data, b"value set")
+        self.assertEqual(c.get("/get").data, b"42")
+        self.assertEqual(c.get("/get").data, b"42")
+        self.assertEqual(client.setex.call_count, 1)
+
+    def test_session_corrupt_data(self):
+        store = {}
+        client = mock.Mock()
+        client.get.side_effect = store.get
+        client.setex.side_effect = lambda name, value, time: store.update(
+            {name: value}
+        )
+
+        app = flask.Flask(__name__)
+        app.config["SESSION_TYPE"] = "redis"
+        app.config["SESSION_REDIS"] = client
+        Session(app)
+
+        @app.route("/set", methods=["POST"])
+        def set():
+            flask.session["value"] = flask.request.form["value"]
+            return "value set"
+
+        @app.route("/get")
+        def get():
+            return flask.session.get("value", "no value")
+
+        c = app.test_client()
+        for val in (
+            b"\xc1",
+            b"\x80\x04garbage",
+            b"\x80\x02}q\x00g9\n",
+            # Huge lengths in legacy pickles raise MemoryError and OverflowError.
+            b"\x80\x05\x96\x00\x00\x00\x00\x00\x00\x00@",
+            b"\x80\x05\x96\xff\xff\xff\xff\xff\xff\xff\xff",
+        ):
+            self.assertEqual(c.post("/set", data={"value": "42"}).data, b"value set")
+            self.assertEqual(c.get("/get").data, b"42")
+            for key in store:
+                store[key] = val
+            self.assertEqual(c.get("/get").data, b"no value")
+
+        # Errors that are not caused by the stored data are not swallowed.
+        class BrokenSession(ServerSideSession):
+            def __init__(self, initial=None, **kwargs):
+                if initial is not None:
+                    raise TypeError("broken session class")
+                super().__init__(initial, **kwargs)
+
+        app.testing = True
+        app.session_interface.session_class = BrokenSession
+        store.clear()
+        self.assertEqual(c.post("/set", data={"value": "42"}).data, b"value set")
+        with self.assertRaises(TypeError):
+            c.get("/get")
+
+    @unittest.skipIf(zstandard is None, "zstandard is not installed")
+    def test_zstd_serializer(self):
+        serializer = ZstdSerializer(MsgPackSerializer())
+        data = {"value": "42" * 1000}
+        val = serializer.dumps(data)
+        self.assertTrue(val.startswith(ZstdSerializer.magic))
+        self.assertLess(len(val), len(MsgPackSerializer().dumps(data)))
+        self.assertEqual(serializer.loads(val), data)
+        # Sessions stored before compression was enabled can still be loaded.
+        self.assertEqual(serializer.loads(MsgPackSerializer().dumps(data)), data)
+        self.assertEqual(serializer.loads(pickle.dumps(data, 0)), data)
+        with self.assertRaises(ValueError):
+            serializer.loads(ZstdSerializer.magic + b"\x00")
+
 
 if __name__ == "__main__":
     unittest.main()